@@ -1,39 +1,76 @@
-from typing import List, Dict, TypedDict
+from typing import AsyncIterator, List, Dict, Tuple, TypedDict
 from langchain_google_genai import ChatGoogleGenerativeAI
 from langgraph.graph import StateGraph, END
 from langgraph.prebuilt import ToolNode
 import asyncio
+import contextvars
 import os
+import time
 from datetime import datetime
 
 from ..services.content_service import content_service
 from ..services.vector_service import vector_service
 from ..services.email_service import email_service
+from ..services.llm_limiter import llm_limiter
+from ..services.content_pool import content_pool
+
+# Queue of (event, data) progress updates for a streamed run, set by stream_newsletter_generation
+progress_events = contextvars.ContextVar("progress_events", default=None)
+
+def emit_progress(event: str, data: Dict):
+    """Report progress to the stream consuming the current run, if any"""
+    events = progress_events.get()
+    if events is not None:
+        events.put_nowait((event, data))
 
 class NewsletterState(TypedDict):
     user_interests: List[str]
-    user_email: str
+    recipient_emails: List[str]
     search_queries: List[str]
     raw_articles: List[Dict]
     processed_articles: List[Dict]
+    newsletter_title: str
     newsletter_content: str
+    newsletter_text: str
     email_status: str
+    delivery_status: Dict[str, str]
+    deadline: float  # time.monotonic() by which the run should finish
+    scrape_fallbacks: List[str]  # urls that kept Tavily's snippet because scraping failed or ran out of time
     error_message: str
 
+# Share of the remaining run deadline given to each stage; time a stage doesn't use carries over
+STAGE_BUDGET_SHARES = {
+    "generate_queries": 0.1,
+    "collect_content": 0.4,
+    "process_content": 0.1,
+    "compose_newsletter": 0.35,
+    "send_email": 0.05,
+}
+
 class NewsletterAgent:
     def __init__(self):
         self.llm = ChatGoogleGenerativeAI(
             model="gemini-1.5-flash",
             temperature=0.7,
-            google_api_key=os.getenv("GEMINI_API_KEY")
+            google_api_key=os.getenv("GEMINI_API_KEY"),
+            max_retries=1  # Rate-limit retries are handled by llm_limiter
         )
+        self.deadline_seconds = float(os.getenv("PIPELINE_DEADLINE_SECONDS", "120"))
         self.workflow = self.create_workflow()
     
+    def stage_budget(self, state: NewsletterState, stage: str) -> float:
+        """Seconds available to a stage: its share of the time left among this and the later stages"""
+        stages = list(STAGE_BUDGET_SHARES)
+        shares_left = sum(STAGE_BUDGET_SHARES[name] for name in stages[stages.index(stage):])
+        remaining = state["deadline"] - time.monotonic()
+        return max(0.0, remaining * STAGE_BUDGET_SHARES[stage] / shares_left)
+    
     def create_workflow(self):
         """Create the LangGraph workflow"""
         workflow = StateGraph(NewsletterState)
         
         # Add nodes
+        workflow.add_node("load_pool", self.load_pooled_content)
         workflow.add_node("generate_queries", self.generate_search_queries)
         workflow.add_node("collect_content", self.collect_content)
         workflow.add_node("process_content", self.process_content)
@@ -41,7 +78,13 @@ class NewsletterAgent:
         workflow.add_node("send_email", self.send_newsletter_email)
         
         # Define edges
-        workflow.set_entry_point("generate_queries")
+        workflow.set_entry_point("load_pool")
+        # Skip live collection when the pre-collected pool is fresh for every interest
+        workflow.add_conditional_edges(
+            "load_pool",
+            lambda state: "process_content" if state["raw_articles"] else "generate_queries",
+            {"process_content": "process_content", "generate_queries": "generate_queries"}
+        )
         workflow.add_edge("generate_queries", "collect_content")
         workflow.add_edge("collect_content", "process_content")
         workflow.add_edge("process_content", "compose_newsletter")
@@ -50,6 +93,22 @@ class NewsletterAgent:
         
         return workflow.compile()
     
+    async def load_pooled_content(self, state: NewsletterState) -> NewsletterState:
+        """Use pre-collected articles when the content pool is fresh for all interests"""
+        if not content_pool.enabled:
+            return state
+        
+        try:
+            pooled = await content_pool.get_fresh_articles(state["user_interests"])
+        except Exception as e:
+            print(f"Error reading content pool: {e}")
+            pooled = None
+        
+        if pooled:
+            print(f"Using {len(pooled)} pooled articles for interests: {state['user_interests']}")
+            state["raw_articles"] = pooled
+        return state
+    
     async def generate_search_queries(self, state: NewsletterState) -> NewsletterState:
         """Generate optimized search queries based on user interests"""
         interests = state["user_interests"]
@@ -79,12 +138,17 @@ class NewsletterAgent:
             Return only the search queries, one per line.
             """
             
-            response = await self.llm.ainvoke(prompt)
+            response = await asyncio.wait_for(
+                llm_limiter.ainvoke(self.llm, prompt),
+                timeout=self.stage_budget(state, "generate_queries")
+            )
             llm_queries = response.content.strip().split('\n')
             print(f"LLM response on query building: {response}")
             queries.extend([q.strip() for q in llm_queries if q.strip()])
             print(f"Generated queries including all: {queries}")
 
+        except asyncio.TimeoutError:
+            print("LLM query generation ran out of time, using base queries")
         except Exception as e:
             print(f"Error generating LLM queries: {e}")
         
@@ -95,17 +159,27 @@ class NewsletterAgent:
     async def collect_content(self, state: NewsletterState) -> NewsletterState:
         """Collect content using Tavily and web scraping"""
         print(f"Collecting content for queries: {state['search_queries']}")
+        stage_deadline = time.monotonic() + self.stage_budget(state, "collect_content")
         try:
-            # Search using Tavily
+            # Search using Tavily, keeping the interests whose search finished within the stage budget
             articles = await content_service.search_content_tavily(
                 interests=state["user_interests"],
-                max_results=20
+                max_results=20,
+                timeout=max(0.0, stage_deadline - time.monotonic())
             )
             
-            # Enhance with scraping if needed
-            articles = await content_service.enhance_articles_with_scraping(articles)
+            # Enhance with scraping if needed, within what is left of the stage budget
+            articles = await content_service.enhance_articles_with_scraping(
+                articles,
+                timeout=max(0.0, stage_deadline - time.monotonic())
+            )
             
             state["raw_articles"] = articles
+            state["scrape_fallbacks"] = [
+                article['url'] for article in articles if article.get('content_source') == 'tavily_snippet'
+            ]
+            if state["scrape_fallbacks"]:
+                print(f"Using Tavily snippets for {len(state['scrape_fallbacks'])} articles that were not scraped in time")
             
         except Exception as e:
             state["error_message"] = f"Content collection failed: {e}"
@@ -122,8 +196,12 @@ class NewsletterAgent:
             return state
         
         try:
-            # Add articles to vector store
-            vector_service.add_articles(raw_articles)
+            # Add articles to vector store; pooled articles are already stored. Runs in a worker thread
+            # because it may wait for the index writer lock held by another process
+            await asyncio.to_thread(
+                vector_service.add_articles,
+                [article for article in raw_articles if article.get('content_source') != 'pool']
+            )
             
             # Remove duplicates and low-quality content
             processed_articles = []
@@ -142,19 +220,14 @@ class NewsletterAgent:
                 seen_titles.add(title)
                 processed_articles.append(article)
             
-            # Sort by relevance and recency
-            processed_articles = sorted(
+            # Pick the top 10 articles by relevance to the interests, penalizing near-duplicates
+            state["processed_articles"] = await asyncio.to_thread(
+                vector_service.rank_articles,
                 processed_articles,
-                key=lambda x: (
-                    x.get('published_at', datetime.min),
-                    len(x.get('content', ''))
-                ),
-                reverse=True
+                state["user_interests"],
+                k=10
             )
             
-            # Limit to top 10 articles
-            state["processed_articles"] = processed_articles[:10]
-            
         except Exception as e:
             state["error_message"] = f"Content processing failed: {e}"
             state["processed_articles"] = []
@@ -166,14 +239,17 @@ class NewsletterAgent:
         articles = state["processed_articles"]
         interests = state["user_interests"]
         
+        interests_str = ", ".join(interests)
+        state["newsletter_title"] = f"🤖 Your AI Newsletter: {interests_str} - {datetime.now().strftime('%Y-%m-%d')}"
+        
         if not articles:
             state["newsletter_content"] = "No relevant articles found for your interests."
+            state["newsletter_text"] = state["newsletter_content"]
             return state
         
         try:
-            # Create article summaries using LLM
-            article_summaries = []
-            for article in articles:
+            # Create article summaries using LLM, concurrently within the limiter's budget
+            async def summarize(article):
                 summary_prompt = f"""
                 Summarize this article in 2-3 sentences, focusing on the key insights:
                 
@@ -183,8 +259,30 @@ class NewsletterAgent:
                 Make it engaging and highlight why it's relevant to someone interested in {article['category']}.
                 """
                 
-                response = await self.llm.ainvoke(summary_prompt)
+                response = await llm_limiter.ainvoke(self.llm, summary_prompt)
                 article['ai_summary'] = response.content.strip()
+                emit_progress("article_summary", {
+                    "title": article['title'],
+                    "url": article['url'],
+                    "category": article['category'],
+                    "summary": article['ai_summary']
+                })
+                return article
+            
+            # Articles not summarized within the stage budget, or whose summary failed, fall back to an excerpt
+            tasks = [asyncio.create_task(summarize(article)) for article in articles]
+            _, pending = await asyncio.wait(tasks, timeout=self.stage_budget(state, "compose_newsletter"))
+            for task in pending:
+                task.cancel()
+            await asyncio.gather(*pending, return_exceptions=True)
+            
+            article_summaries = []
+            for article, task in zip(articles, tasks):
+                if task in pending:
+                    article['ai_summary'] = article['content'][:300]
+                elif task.exception() is not None:
+                    print(f"Error summarizing {article['url']}: {task.exception()}")
+                    article['ai_summary'] = article['content'][:300]
                 article_summaries.append(article)
             
             # Generate newsletter HTML
@@ -195,57 +293,164 @@ class NewsletterAgent:
             
             state["newsletter_content"] = html_content
             
+            # Plain-text version kept with the newsletter history
+            state["newsletter_text"] = "\n\n".join(
+                f"{article['title']}\n{article['ai_summary']}\n{article['url']}" for article in article_summaries
+            )
+            
         except Exception as e:
             state["error_message"] = f"Newsletter composition failed: {e}"
             state["newsletter_content"] = "Failed to compose newsletter."
+            state["newsletter_text"] = state["newsletter_content"]
         
         return state
     
+    async def deliver_newsletter(self, recipients: List[str], subject: str, html_content: str) -> Dict[str, str]:
+        """Send a composed newsletter to recipients and return each one's status.
+        
+        SMTP is blocking, so it runs in a worker thread to keep the event loop free.
+        """
+        if len(recipients) == 1:
+            success = await asyncio.to_thread(
+                email_service.send_newsletter,
+                to_email=recipients[0],
+                subject=subject,
+                html_content=html_content
+            )
+            results = {recipients[0]: success}
+        else:
+            results = await asyncio.to_thread(
+                email_service.send_newsletter_batch,
+                to_emails=recipients,
+                subject=subject,
+                html_content=html_content
+            )
+        
+        return {email: "sent" if success else "failed" for email, success in results.items()}
+    
     async def send_newsletter_email(self, state: NewsletterState) -> NewsletterState:
-        """Send the newsletter via email"""
+        """Send the newsletter via email to every recipient"""
+        recipients = state["recipient_emails"]
+        if not recipients:
+            return state  # Generated only; the caller delivers it
+        
         try:
-            user_email = state["user_email"]
-            content = state["newsletter_content"]
-            interests_str = ", ".join(state["user_interests"])
-            
-            subject = f"🤖 Your AI Newsletter: {interests_str} - {datetime.now().strftime('%Y-%m-%d')}"
-            
-            success = email_service.send_newsletter(
-                to_email=user_email,
-                subject=subject,
-                html_content=content
+            state["delivery_status"] = await self.deliver_newsletter(
+                recipients,
+                state["newsletter_title"],
+                state["newsletter_content"]
             )
-            
-            state["email_status"] = "sent" if success else "failed"
+            state["email_status"] = "sent" if all(
+                status == "sent" for status in state["delivery_status"].values()
+            ) else "failed"
             
         except Exception as e:
             state["error_message"] = f"Email sending failed: {e}"
+            state["delivery_status"] = {email: "failed" for email in recipients}
             state["email_status"] = "failed"
         
         return state
     
     async def run_newsletter_generation(self, user_email: str, user_interests: List[str]) -> Dict:
         """Run the complete newsletter generation workflow"""
-        initial_state = NewsletterState(
+        return await self.run_cohort_generation([user_email], user_interests)
+    
+    def create_initial_state(self, user_emails: List[str], user_interests: List[str]) -> NewsletterState:
+        """Initial workflow state for a run"""
+        return NewsletterState(
             user_interests=user_interests,
-            user_email=user_email,
+            recipient_emails=user_emails,
             search_queries=[],
             raw_articles=[],
             processed_articles=[],
+            newsletter_title="",
             newsletter_content="",
+            newsletter_text="",
             email_status="pending",
+            delivery_status={},
+            deadline=time.monotonic() + self.deadline_seconds,
+            scrape_fallbacks=[],
             error_message=""
         )
-        
-        # Execute the workflow
-        final_state = await self.workflow.ainvoke(initial_state)
-        
+    
+    def build_result(self, final_state: NewsletterState) -> Dict:
+        """Summarize a finished run"""
         return {
             "status": final_state["email_status"],
+            "delivery_status": final_state["delivery_status"],
             "articles_found": len(final_state["processed_articles"]),
+            "title": final_state["newsletter_title"],
+            "content": final_state["newsletter_text"],
             "newsletter_content": final_state["newsletter_content"],
+            "scrape_fallbacks": final_state["scrape_fallbacks"],
             "error": final_state.get("error_message", "")
         }
-
+    
+    def node_progress(self, node: str, state: NewsletterState) -> Dict:
+        """What a completed node produced, for progress events"""
+        progress = {"node": node}
+        if node == "load_pool":
+            progress["pooled_articles"] = len(state["raw_articles"])
+        elif node == "generate_queries":
+            progress["search_queries"] = state["search_queries"]
+        elif node == "collect_content":
+            progress["articles_collected"] = len(state["raw_articles"])
+            progress["scrape_fallbacks"] = len(state["scrape_fallbacks"])
+        elif node == "process_content":
+            progress["articles_selected"] = [
+                {"title": article["title"], "url": article["url"], "category": article["category"]}
+                for article in state["processed_articles"]
+            ]
+        elif node == "compose_newsletter":
+            progress["title"] = state["newsletter_title"]
+        elif node == "send_email":
+            progress["status"] = state["email_status"]
+        if state.get("error_message"):
+            progress["error"] = state["error_message"]
+        return progress
+    
+    async def run_cohort_generation(self, user_emails: List[str], user_interests: List[str]) -> Dict:
+        """Generate one newsletter for an interest set and send it to every recipient (none: generate only)"""
+        initial_state = self.create_initial_state(user_emails, user_interests)
+        
+        # Execute the workflow
+        final_state = await self.workflow.ainvoke(initial_state)
+        
+        return self.build_result(final_state)
+    
+    async def stream_newsletter_generation(self, user_email: str, user_interests: List[str]) -> AsyncIterator[Tuple[str, Dict]]:
+        """Run the workflow, yielding (event, data) as each node completes and each summary is ready.
+        
+        Events are node_completed, article_summary, and finally result or error.
+        """
+        events = asyncio.Queue()
+        
+        async def drive():
+            # Set inside this task so nodes running under it report to this stream only
+            progress_events.set(events)
+            try:
+                final_state = None
+                async for chunk in self.workflow.astream(self.create_initial_state([user_email], user_interests)):
+                    for node, state in chunk.items():
+                        final_state = state
+                        if node != END:
+                            events.put_nowait(("node_completed", self.node_progress(node, state)))
+                events.put_nowait(("result", self.build_result(final_state)))
+            except Exception as e:
+                events.put_nowait(("error", {"detail": f"Newsletter generation failed: {e}"}))
+            finally:
+                events.put_nowait(None)
+        
+        task = asyncio.create_task(drive())
+        try:
+            while True:
+                event = await events.get()
+                if event is None:
+                    break
+                yield event
+        finally:
+            # The client went away: stop the run
+            task.cancel()
+    
 # Global instance
 newsletter_agent = NewsletterAgent()
\ No newline at end of file
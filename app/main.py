@@ -1,16 +1,31 @@
 from fastapi import FastAPI, Depends, HTTPException, BackgroundTasks
 from fastapi.middleware.cors import CORSMiddleware
-from sqlalchemy.orm import Session
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+import os
 
-from .database import engine, get_db
-from .models import Base, User
+from .database import engine, async_engine, get_async_db, AsyncSessionLocal
+from .models import Base, User, Article, Newsletter
 from .routers import users, newsletters
 from .agents.newsletter_agent import newsletter_agent
 from .services.content_service import content_service
+from .services.vector_service import vector_service
+from .services.newsletter_service import newsletter_service
+from .services.search_batcher import search_batcher
+from .services.llm_limiter import llm_limiter
+from .services.content_pool import content_pool
 
 # Create tables
 Base.metadata.create_all(bind=engine)
 
+def create_missing_indexes(tables):
+    """Add indexes declared after a table was created; create_all skips tables that already exist"""
+    for table in tables:
+        for index in table.indexes:
+            index.create(bind=engine, checkfirst=True)
+
+create_missing_indexes([Article.__table__, Newsletter.__table__])
+
 app = FastAPI(
     title="Newsletter AI Agent",
     description="AI-powered newsletter generation system",
@@ -33,40 +48,117 @@ app.include_router(newsletters.router)
 async def root():
     return {"message": "Newsletter AI Agent API is running!"}
 
+USER_BATCH_SIZE = int(os.getenv("USER_BATCH_SIZE", "500"))
+
+async def iter_active_users(batch_size: int = USER_BATCH_SIZE):
+    """Stream (id, email, interests) of active users in id-ordered batches"""
+    last_id = 0
+    while True:
+        # Each batch uses a short-lived session so no connection is held while newsletters are generated
+        async with AsyncSessionLocal() as db:
+            rows = (await db.execute(
+                select(User.id, User.email, User.interests)
+                .where(User.is_active == True, User.id > last_id)
+                .order_by(User.id)
+                .limit(batch_size)
+            )).all()
+        
+        if not rows:
+            return
+        for row in rows:
+            yield row
+        last_id = rows[-1].id
+
+def interest_cohort_key(interests: list) -> tuple:
+    """Normalize an interest list so users with the same interests share a cohort"""
+    return tuple(sorted({interest.strip().lower() for interest in interests if interest and interest.strip()}))
+
+async def active_interests() -> list:
+    """Distinct interests of active users, for content pre-collection"""
+    interests = {}
+    async for user in iter_active_users():
+        for interest in user.interests or []:
+            interests.setdefault(interest, None)
+    return list(interests)
+
+@app.get("/metrics/llm")
+async def llm_metrics():
+    """LLM queueing delay and rate limiter state"""
+    return llm_limiter.metrics()
+
 # Background task function
 async def send_newsletters_background():
     """Send newsletters to all active users using FastAPI BackgroundTasks"""
     print("Running newsletter generation...")
     
     try:
-        from .database import SessionLocal
-        db = SessionLocal()
+        # First pass: distinct interest sets only, so memory grows with cohorts rather than subscribers
+        cohorts = {}
+        async for user in iter_active_users():
+            key = interest_cohort_key(user.interests or [])
+            if key and key not in cohorts:
+                cohorts[key] = user.interests
         
-        users = db.query(User).filter(User.is_active == True).all()
+        # Generate once per cohort
+        print(f"Generating {len(cohorts)} cohort newsletters")
+        newsletters = {}
+        for key, interests in cohorts.items():
+            try:
+                newsletters[key] = await newsletter_agent.run_cohort_generation(
+                    user_emails=[],
+                    user_interests=interests
+                )
+            except Exception as e:
+                print(f"Failed to generate newsletter for cohort {interests}: {e}")
         
-        for user in users:
-            if user.interests:
+        # Second pass: stream users again and fan each batch out to its cohorts' newsletters
+        async def deliver(batch):
+            members_by_cohort = {}
+            for user_id, email, key in batch:
+                members_by_cohort.setdefault(key, []).append((user_id, email))
+            
+            records = []
+            for key, members in members_by_cohort.items():
+                result = newsletters[key]
                 try:
-                    result = await newsletter_agent.run_newsletter_generation(
-                        user_email=user.email,
-                        user_interests=user.interests
+                    delivery_status = await newsletter_agent.deliver_newsletter(
+                        [email for _, email in members],
+                        result["title"],
+                        result["newsletter_content"]
                     )
-                    print(f"Newsletter sent to {user.email}: {result['status']}")
                 except Exception as e:
-                    print(f"Failed to send newsletter to {user.email}: {e}")
+                    print(f"Failed to send newsletter to cohort {cohorts[key]}: {e}")
+                    delivery_status = {}
+                
+                for user_id, email in members:
+                    status = delivery_status.get(email, "failed")
+                    records.append(newsletter_service.build_record(user_id, result, status=status))
+                    print(f"Newsletter sent to {email}: {status}")
+            
+            # Newsletters are inserted in batches rather than one commit per user
+            await newsletter_service.save_newsletters(records)
         
-        db.close()
+        batch = []
+        async for user in iter_active_users():
+            key = interest_cohort_key(user.interests or [])
+            if key in newsletters:
+                batch.append((user.id, user.email, key))
+            if len(batch) >= newsletter_service.batch_size:
+                await deliver(batch)
+                batch = []
+        await deliver(batch)
         
     except Exception as e:
         print(f"Newsletter task failed: {e}")
 
-async def send_single_newsletter_background(user_email: str, user_interests: list):
+async def send_single_newsletter_background(user_id: int, user_email: str, user_interests: list):
     """Send newsletter to a single user"""
     try:
         result = await newsletter_agent.run_newsletter_generation(
             user_email=user_email,
             user_interests=user_interests
         )
+        await newsletter_service.save_newsletter(user_id, result)
         print(f"Newsletter sent to {user_email}: {result['status']}")
     except Exception as e:
         print(f"Failed to send newsletter to {user_email}: {e}")
@@ -78,19 +170,28 @@ async def trigger_newsletters(background_tasks: BackgroundTasks):
     return {"message": "Newsletter generation started"}
 
 @app.post("/send-newsletter/{user_id}")
-async def trigger_single_newsletter(user_id: int, background_tasks: BackgroundTasks, db: Session = Depends(get_db)):
+async def trigger_single_newsletter(user_id: int, background_tasks: BackgroundTasks, db: AsyncSession = Depends(get_async_db)):
     """Send newsletter to a specific user"""
-    user = db.query(User).filter(User.id == user_id).first()
+    user = await db.get(User, user_id)
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
     
     if not user.interests:
         raise HTTPException(status_code=400, detail="User has no interests set")
     
-    background_tasks.add_task(send_single_newsletter_background, user.email, user.interests)
+    background_tasks.add_task(send_single_newsletter_background, user.id, user.email, user.interests)
     return {"message": "Newsletter generation started"}
 
+@app.on_event("startup")
+async def startup_event():
+    """Move legacy pickled article metadata into the database and start content pre-collection"""
+    vector_service.migrate_legacy_metadata()
+    content_pool.start(active_interests)
+
 @app.on_event("shutdown")
 async def shutdown_event():
     """Cleanup on shutdown"""
     await content_service.close()
+    await search_batcher.close()
+    await content_pool.close()
+    await async_engine.dispose()
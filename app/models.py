@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, DateTime, Text, Boolean, JSON, ForeignKey
+from sqlalchemy import Column, Integer, String, DateTime, Text, Boolean, JSON, ForeignKey, Index
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import relationship
 from datetime import datetime
@@ -29,6 +29,9 @@ class Newsletter(Base):
     status = Column(String, default="draft")  # draft, sent, failed
     
     user = relationship("User", back_populates="subscriptions")
+    
+    # Serves the keyset-paginated history query
+    __table_args__ = (Index("ix_newsletters_user_sent_at_id", "user_id", "sent_at", "id"),)
 
 class Article(Base):
     __tablename__ = "articles"
@@ -36,9 +39,9 @@ class Article(Base):
     id = Column(Integer, primary_key=True, index=True)
     title = Column(String)
     content = Column(Text)
-    url = Column(String)
+    url = Column(String, index=True)
     source = Column(String)
-    category = Column(String)
-    published_at = Column(DateTime)
+    category = Column(String, index=True)
+    published_at = Column(DateTime, index=True)
     scraped_at = Column(DateTime, default=datetime.utcnow)
-    embedding_id = Column(String)  # Reference to FAISS vector
\ No newline at end of file
+    embedding_id = Column(String)  # Reference to FAISS vector (the FAISS id is the article id)
\ No newline at end of file
@@ -1,25 +1,54 @@
 from fastapi import APIRouter, Depends, HTTPException, BackgroundTasks
-from sqlalchemy.orm import Session
-from typing import List
+from sqlalchemy import select, tuple_
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import defer
+from typing import List, Optional
+from datetime import datetime
+import asyncio
 
-from ..database import get_db
+from ..database import get_async_db
 from ..models import User, Newsletter, Article
-from ..schemas import NewsletterResponse, ArticleResponse
+from ..schemas import NewsletterResponse, NewsletterPage, ArticleResponse
 from ..services.vector_service import vector_service
 from ..services.content_service import content_service
+from ..services.search_batcher import search_batcher
 
 router = APIRouter(prefix="/newsletters", tags=["newsletters"])
 
-@router.get("/", response_model=List[NewsletterResponse])
-async def get_user_newsletters(user_id: int, db: Session = Depends(get_db)):
-    """Get all newsletters for a user"""
-    newsletters = db.query(Newsletter).filter(Newsletter.user_id == user_id).order_by(Newsletter.sent_at.desc()).all()
-    return newsletters
+def encode_cursor(newsletter: Newsletter) -> str:
+    """Encode the position of the last newsletter on a page"""
+    return f"{newsletter.sent_at.isoformat()}_{newsletter.id}"
+
+def decode_cursor(cursor: str):
+    """Decode a cursor produced by encode_cursor"""
+    try:
+        sent_at, newsletter_id = cursor.rsplit("_", 1)
+        return datetime.fromisoformat(sent_at), int(newsletter_id)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+@router.get("/", response_model=NewsletterPage)
+async def get_user_newsletters(user_id: int, cursor: Optional[str] = None, limit: int = 20, db: AsyncSession = Depends(get_async_db)):
+    """Get a page of newsletters for a user, newest first"""
+    limit = max(1, min(limit, 100))
+    
+    # Keyset pagination on (sent_at, id); the large body columns are not loaded for the listing
+    stmt = select(Newsletter).options(
+        defer(Newsletter.content), defer(Newsletter.html_content)
+    ).where(Newsletter.user_id == user_id)
+    if cursor:
+        stmt = stmt.where(tuple_(Newsletter.sent_at, Newsletter.id) < tuple_(*decode_cursor(cursor)))
+    
+    stmt = stmt.order_by(Newsletter.sent_at.desc(), Newsletter.id.desc()).limit(limit + 1)
+    newsletters = (await db.scalars(stmt)).all()
+    
+    next_cursor = encode_cursor(newsletters[limit - 1]) if len(newsletters) > limit else None
+    return {"newsletters": newsletters[:limit], "next_cursor": next_cursor}
 
 @router.get("/{newsletter_id}", response_model=NewsletterResponse)
-async def get_newsletter(newsletter_id: int, db: Session = Depends(get_db)):
+async def get_newsletter(newsletter_id: int, db: AsyncSession = Depends(get_async_db)):
     """Get a specific newsletter"""
-    newsletter = db.query(Newsletter).filter(Newsletter.id == newsletter_id).first()
+    newsletter = await db.get(Newsletter, newsletter_id)
     if not newsletter:
         raise HTTPException(status_code=404, detail="Newsletter not found")
     return newsletter
@@ -28,7 +57,7 @@ async def get_newsletter(newsletter_id: int, db: Session = Depends(get_db)):
 async def search_articles(query: str, interests: List[str] = None, limit: int = 10):
     """Search articles using vector similarity"""
     try:
-        results = vector_service.search_similar_articles(
+        results = await search_batcher.search(
             query=query,
             k=limit,
             interests=interests
@@ -37,11 +66,25 @@ async def search_articles(query: str, interests: List[str] = None, limit: int =
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Search failed: {str(e)}")
 
+@router.post("/articles/compact")
+async def compact_articles(retention_days: Optional[int] = None, max_per_category: Optional[int] = None):
+    """Remove articles past retention and rebuild a dense vector index"""
+    try:
+        # Runs in a worker thread; searches keep serving the current index version meanwhile
+        report = await asyncio.to_thread(
+            vector_service.compact_index,
+            retention_days=retention_days,
+            max_per_category=max_per_category
+        )
+        return report
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Compaction failed: {str(e)}")
+
 @router.get("/trending/topics")
-async def get_trending_topics(interests: List[str] = None):
+async def get_trending_topics(interests: List[str] = None, db: AsyncSession = Depends(get_async_db)):
     """Get trending topics"""
     try:
-        trending = vector_service.get_trending_topics(interests=interests)
+        trending = await vector_service.get_trending_topics(db, interests=interests)
         return {"trending_topics": trending}
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Failed to get trending topics: {str(e)}")
@@ -53,7 +96,7 @@ async def collect_content_for_interests(interests: List[str], background_tasks:
         try:
             articles = await content_service.search_content_tavily(interests, max_results=50)
             articles = await content_service.enhance_articles_with_scraping(articles)
-            vector_service.add_articles(articles)
+            await asyncio.to_thread(vector_service.add_articles, articles)
         except Exception as e:
             print(f"Background content collection failed: {e}")
     
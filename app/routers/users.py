@@ -1,21 +1,26 @@
 from fastapi import APIRouter, Depends, HTTPException, status
-from sqlalchemy.orm import Session
+from fastapi.responses import StreamingResponse
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 from passlib.context import CryptContext
 from typing import List
+import json
 
-from ..database import get_db
+from ..database import get_async_db
 from ..models import User
 from ..schemas import UserCreate, UserResponse
 from ..agents.newsletter_agent import newsletter_agent
+from ..services.newsletter_service import newsletter_service
+from ..services.llm_limiter import llm_priority, INTERACTIVE
 
 router = APIRouter(prefix="/users", tags=["users"])
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 
 @router.post("/register", response_model=UserResponse)
-async def register_user(user: UserCreate, db: Session = Depends(get_db)):
+async def register_user(user: UserCreate, db: AsyncSession = Depends(get_async_db)):
     """Register a new user"""
     # Check if user exists
-    existing_user = db.query(User).filter(User.email == user.email).first()
+    existing_user = await db.scalar(select(User).where(User.email == user.email))
     if existing_user:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
@@ -33,46 +38,54 @@ async def register_user(user: UserCreate, db: Session = Depends(get_db)):
     )
     
     db.add(db_user)
-    db.commit()
-    db.refresh(db_user)
+    await db.commit()
+    await db.refresh(db_user)
     
     return db_user
 
 @router.get("/me", response_model=UserResponse)
-async def get_current_user(user_id: int, db: Session = Depends(get_db)):
+async def get_current_user(user_id: int, db: AsyncSession = Depends(get_async_db)):
     """Get current user profile"""
-    user = db.query(User).filter(User.id == user_id).first()
+    user = await db.get(User, user_id)
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
     return user
 
 @router.put("/interests")
-async def update_interests(user_id: int, interests: List[str], db: Session = Depends(get_db)):
+async def update_interests(user_id: int, interests: List[str], db: AsyncSession = Depends(get_async_db)):
     """Update user interests"""
-    user = db.query(User).filter(User.id == user_id).first()
+    user = await db.get(User, user_id)
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
     
     user.interests = interests
-    db.commit()
+    await db.commit()
     
     return {"message": "Interests updated successfully"}
 
 @router.post("/generate-newsletter")
-async def generate_newsletter_for_user(user_id: int, db: Session = Depends(get_db)):
+async def generate_newsletter_for_user(user_id: int, db: AsyncSession = Depends(get_async_db)):
     """Generate and send newsletter for a specific user"""
-    user = db.query(User).filter(User.id == user_id).first()
+    user = await db.get(User, user_id)
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
     
     if not user.interests:
         raise HTTPException(status_code=400, detail="User has no interests set")
     
+    # Release the connection before the long-running pipeline
+    user_id, user_email, user_interests = user.id, user.email, user.interests
+    await db.close()
+    
+    # A user is waiting on this response, so its LLM calls go ahead of bulk runs
+    llm_priority.set(INTERACTIVE)
+    
     try:
         result = await newsletter_agent.run_newsletter_generation(
-            user_email=user.email,
-            user_interests=user.interests
+            user_email=user_email,
+            user_interests=user_interests
         )
+        result["newsletter_id"] = await newsletter_service.save_newsletter(user_id, result)
         
         return result
         
@@ -81,3 +94,29 @@ async def generate_newsletter_for_user(user_id: int, db: Session = Depends(get_d
             status_code=500,
             detail=f"Newsletter generation failed: {str(e)}"
         )
+
+@router.post("/generate-newsletter/stream")
+async def stream_newsletter_for_user(user_id: int, db: AsyncSession = Depends(get_async_db)):
+    """Generate and send newsletter for a specific user, streaming progress as Server-Sent Events"""
+    user = await db.get(User, user_id)
+    if not user:
+        raise HTTPException(status_code=404, detail="User not found")
+    
+    if not user.interests:
+        raise HTTPException(status_code=400, detail="User has no interests set")
+    
+    user_id, user_email, user_interests = user.id, user.email, user.interests
+    await db.close()
+    
+    async def event_stream():
+        llm_priority.set(INTERACTIVE)
+        async for event, data in newsletter_agent.stream_newsletter_generation(user_email, user_interests):
+            if event == "result":
+                data["newsletter_id"] = await newsletter_service.save_newsletter(user_id, data)
+            yield f"event: {event}\ndata: {json.dumps(data, default=str)}\n\n"
+    
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
@@ -31,6 +31,19 @@ class NewsletterResponse(BaseModel):
     class Config:
         from_attributes = True
 
+class NewsletterSummaryResponse(BaseModel):
+    id: int
+    title: str
+    sent_at: datetime
+    status: str
+    
+    class Config:
+        from_attributes = True
+
+class NewsletterPage(BaseModel):
+    newsletters: List[NewsletterSummaryResponse]
+    next_cursor: Optional[str] = None
+
 class ArticleResponse(BaseModel):
     id: int
     title: str
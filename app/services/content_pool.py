@@ -0,0 +1,117 @@
+import asyncio
+import fcntl
+import os
+from datetime import datetime, timedelta
+from sqlalchemy import select
+from typing import Awaitable, Callable, Dict, List, Optional
+
+from ..database import AsyncSessionLocal
+from ..models import Article
+from .content_service import content_service
+from .vector_service import vector_service
+
+class ContentPool:
+    """Per-interest pool of collected, scraped and embedded articles, kept fresh ahead of send time.
+    
+    Pooled articles are the rows of the articles table whose scraped_at (the last time collection
+    saw them) is within CONTENT_POOL_MAX_AGE_HOURS.
+    """
+    def __init__(self):
+        self.max_age = timedelta(hours=float(os.getenv("CONTENT_POOL_MAX_AGE_HOURS", "6")))
+        self.min_articles = int(os.getenv("CONTENT_POOL_MIN_ARTICLES", "5"))
+        self.articles_per_interest = int(os.getenv("CONTENT_POOL_ARTICLES_PER_INTEREST", "10"))
+        # Minutes between scheduled pre-collections; 0 disables them
+        self.refresh_minutes = float(os.getenv("CONTENT_POOL_REFRESH_MINUTES", "0"))
+        self.lock_file = "content_pool.lock"
+        self.lock = None
+        self.task = None
+    
+    @property
+    def enabled(self) -> bool:
+        """Newsletter runs only read from the pool when scheduled pre-collection keeps it fresh"""
+        return self.refresh_minutes > 0
+    
+    async def fresh_articles_by_interest(self, interests: List[str]) -> Dict[str, List[Dict]]:
+        """Fresh pooled articles for each interest, newest first"""
+        cutoff = datetime.utcnow() - self.max_age
+        stmt = select(Article).where(
+            Article.category.in_(interests),
+            Article.scraped_at >= cutoff,
+            Article.content.is_not(None)
+        ).order_by(Article.scraped_at.desc())
+        
+        async with AsyncSessionLocal() as db:
+            rows = (await db.scalars(stmt)).all()
+        
+        pooled = {interest: [] for interest in interests}
+        for row in rows:
+            if len(pooled[row.category]) < self.articles_per_interest:
+                pooled[row.category].append({
+                    'title': row.title,
+                    'content': row.content,
+                    'url': row.url,
+                    'source': row.source,
+                    'category': row.category,
+                    'published_at': row.published_at,
+                    'content_source': 'pool'
+                })
+        return pooled
+    
+    async def get_fresh_articles(self, interests: List[str]) -> Optional[List[Dict]]:
+        """Pooled articles for the interests, or None unless every interest has enough fresh articles"""
+        pooled = await self.fresh_articles_by_interest(interests)
+        if any(len(articles) < self.min_articles for articles in pooled.values()):
+            return None
+        return [article for articles in pooled.values() for article in articles]
+    
+    async def collect(self, interests: List[str]):
+        """Search, scrape and embed articles for the interests into the pool"""
+        articles = await content_service.search_content_tavily(
+            interests,
+            max_results=self.articles_per_interest * len(interests)
+        )
+        articles = await content_service.enhance_articles_with_scraping(articles)
+        await asyncio.to_thread(vector_service.add_articles, articles)
+    
+    async def refresh(self, interests: List[str]):
+        """Collect for the interests whose pool is not fresh enough"""
+        pooled = await self.fresh_articles_by_interest(interests)
+        stale = [interest for interest, articles in pooled.items() if len(articles) < self.min_articles]
+        if stale:
+            print(f"Pre-collecting content for {len(stale)} of {len(interests)} interests")
+            await self.collect(stale)
+    
+    async def run(self, get_interests: Callable[[], Awaitable[List[str]]]):
+        """Refresh the pool for the current interests every refresh_minutes"""
+        while True:
+            try:
+                await self.refresh(await get_interests())
+            except Exception as e:
+                print(f"Content pre-collection failed: {e}")
+            await asyncio.sleep(self.refresh_minutes * 60)
+    
+    def start(self, get_interests: Callable[[], Awaitable[List[str]]]):
+        """Start scheduled pre-collection in this process, unless another worker already runs it"""
+        if not self.enabled or self.task is not None:
+            return
+        
+        self.lock = open(self.lock_file, 'w')
+        try:
+            fcntl.flock(self.lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            self.lock.close()
+            self.lock = None
+            return
+        
+        self.task = asyncio.create_task(self.run(get_interests))
+    
+    async def close(self):
+        """Stop scheduled pre-collection"""
+        if self.task is not None:
+            self.task.cancel()
+            self.task = None
+        if self.lock is not None:
+            self.lock.close()
+            self.lock = None
+
+content_pool = ContentPool()
@@ -10,18 +10,23 @@ class ContentService:
     def __init__(self):
         self.tavily_client = TavilyClient(api_key=os.getenv("TAVILY_API_KEY"))
         self.session = httpx.AsyncClient()
+        # Start a second request for a scrape still running after this many seconds (0 disables hedging)
+        self.hedge_after = float(os.getenv("SCRAPE_HEDGE_AFTER_SECONDS", "3"))
     
-    async def search_content_tavily(self, interests: List[str], max_results: int = 20) -> List[Dict]:
-        """Search for content using Tavily API"""
-        all_articles = []
+    async def search_content_tavily(self, interests: List[str], max_results: int = 20, timeout: float = None) -> List[Dict]:
+        """Search for content using Tavily API.
         
-        for interest in interests:
+        Interests whose search is still running after timeout seconds are left out; the results of
+        the interests that finished in time are kept.
+        """
+        async def search_interest(interest):
             try:
                 # Create search query
                 query = f"{interest} technology news latest"
                 
-                # Search with Tavily
-                results = self.tavily_client.search(
+                # Search with Tavily; the client is synchronous, so it runs in a worker thread
+                results = await asyncio.to_thread(
+                    self.tavily_client.search,
                     query=query,
                     search_depth="advanced",
                     max_results=max_results // len(interests),
@@ -29,8 +34,8 @@ class ContentService:
                 )
                 
                 # Process results
-                for result in results.get('results', []):
-                    article = {
+                return [
+                    {
                         'title': result.get('title', ''),
                         'content': result.get('content', ''),
                         'url': result.get('url', ''),
@@ -39,13 +44,26 @@ class ContentService:
                         'published_at': datetime.now() - timedelta(days=1),  # Approximate
                         'raw_content': result.get('raw_content', '')
                     }
-                    all_articles.append(article)
+                    for result in results.get('results', [])
+                ]
                     
             except Exception as e:
                 print(f"Error searching for {interest}: {e}")
-                continue
+                return []
         
-        return all_articles
+        if not interests:
+            return []
+        
+        # Search interests concurrently, proceeding with whatever finished in time
+        tasks = [asyncio.create_task(search_interest(interest)) for interest in interests]
+        _, pending = await asyncio.wait(tasks, timeout=timeout)
+        if pending:
+            print(f"Tavily search timed out for {len(pending)} of {len(tasks)} interests")
+            for task in pending:
+                task.cancel()
+            await asyncio.gather(*pending, return_exceptions=True)
+        
+        return [article for task in tasks if task not in pending for article in task.result()]
     
     async def scrape_article_content(self, url: str) -> Dict:
         """Scrape full article content using Beautiful Soup"""
@@ -112,6 +130,28 @@ class ContentService:
                 'scraped_successfully': False
             }
     
+    async def scrape_article_hedged(self, url: str) -> Dict:
+        """Scrape an article, issuing a second request if the first is slower than hedge_after"""
+        tasks = {asyncio.create_task(self.scrape_article_content(url))}
+        try:
+            if self.hedge_after > 0:
+                done, _ = await asyncio.wait(tasks, timeout=self.hedge_after)
+                if not done:
+                    tasks.add(asyncio.create_task(self.scrape_article_content(url)))
+            
+            # Take the first successful scrape
+            scraped = None
+            while tasks:
+                done, tasks = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    scraped = task.result()
+                    if scraped['scraped_successfully']:
+                        return scraped
+            return scraped
+        finally:
+            for task in tasks:
+                task.cancel()
+    
     def extract_domain(self, url: str) -> str:
         """Extract domain from URL"""
         try:
@@ -120,26 +160,41 @@ class ContentService:
         except:
             return "unknown"
     
-    async def enhance_articles_with_scraping(self, articles: List[Dict]) -> List[Dict]:
-        """Enhance articles with full content via scraping"""
-        enhanced_articles = []
+    async def enhance_articles_with_scraping(self, articles: List[Dict], timeout: float = None) -> List[Dict]:
+        """Enhance articles with full content via scraping.
         
+        Scrapes still running after timeout seconds are cancelled; those articles keep Tavily's
+        snippet and are marked with content_source 'tavily_snippet'.
+        """
         # Limit concurrent requests
         semaphore = asyncio.Semaphore(5)
         
         async def scrape_single(article):
             async with semaphore:
-                if len(article.get('content', '')) < 200:  # If content is too short
-                    scraped = await self.scrape_article_content(article['url'])
-                    if scraped['scraped_successfully']:
-                        article.update(scraped)
-                return article
+                scraped = await self.scrape_article_hedged(article['url'])
+                if scraped['scraped_successfully']:
+                    article.update(scraped)
+                    article['content_source'] = 'scraped'
+        
+        to_scrape = []
+        for article in articles:
+            article['content_source'] = 'tavily'
+            if len(article.get('content', '')) < 200:  # If content is too short
+                to_scrape.append(article)
+        
+        # Process articles concurrently, proceeding with whatever finished in time
+        tasks = [asyncio.create_task(scrape_single(article)) for article in to_scrape]
+        if tasks:
+            _, pending = await asyncio.wait(tasks, timeout=timeout)
+            for task in pending:
+                task.cancel()
+            await asyncio.gather(*pending, return_exceptions=True)
         
-        # Process articles concurrently
-        tasks = [scrape_single(article) for article in articles]
-        enhanced_articles = await asyncio.gather(*tasks)
+        for article in to_scrape:
+            if article['content_source'] != 'scraped':
+                article['content_source'] = 'tavily_snippet'
         
-        return enhanced_articles
+        return articles
     
     async def close(self):
         """Close the HTTP session"""
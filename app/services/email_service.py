@@ -80,4 +80,30 @@ class EmailService:
             print(f"Error sending email to {to_email}: {e}")
             return False
 
+    def send_newsletter_batch(self, to_emails: List[str], subject: str, html_content: str) -> Dict[str, bool]:
+        """Send the same newsletter to several recipients over one SMTP connection"""
+        results = {email: False for email in to_emails}
+        try:
+            with smtplib.SMTP(self.smtp_server, self.smtp_port) as server:
+                server.starttls()
+                server.login(self.smtp_username, self.smtp_password)
+                
+                for to_email in to_emails:
+                    try:
+                        msg = MIMEMultipart('alternative')
+                        msg['Subject'] = subject
+                        msg['From'] = self.smtp_username
+                        msg['To'] = to_email
+                        msg.attach(MIMEText(html_content, 'html'))
+                        
+                        server.send_message(msg)
+                        results[to_email] = True
+                    except Exception as e:
+                        print(f"Error sending email to {to_email}: {e}")
+            
+        except Exception as e:
+            print(f"Error sending newsletter batch: {e}")
+        
+        return results
+
 email_service = EmailService()
\ No newline at end of file
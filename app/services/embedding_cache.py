@@ -0,0 +1,100 @@
+import numpy as np
+import fcntl
+import hashlib
+import os
+import threading
+from typing import List, Callable
+
+class EmbeddingCache:
+    """Append-only on-disk cache of embeddings keyed by a hash of model id and text.
+    
+    Vectors are stored as rows of a float32 file that is memory-mapped for reads; a
+    parallel keys file holds the 16-byte hash of each row. Rows are appended under an
+    exclusive lock, vectors before keys, so a key is only visible once its vector is.
+    Within a process, a thread lock keeps rows, count and vectors consistent for lookups.
+    """
+    key_size = 16
+    
+    def __init__(self, dimension: int, path_prefix: str = "embedding_cache"):
+        self.dimension = dimension
+        self.vectors_file = f"{path_prefix}.f32"
+        self.keys_file = f"{path_prefix}.keys"
+        self.lock_file = f"{path_prefix}.lock"
+        self.rows = {}  # key hash -> row number
+        self.count = 0
+        self.vectors = np.zeros((0, dimension), dtype=np.float32)
+        self.lock = threading.Lock()
+        self.refresh()
+    
+    def key(self, model_id: str, text: str) -> bytes:
+        """Hash a text together with the model that embeds it"""
+        return hashlib.blake2b(f"{model_id}\0{text}".encode("utf-8"), digest_size=self.key_size).digest()
+    
+    def refresh(self):
+        """Load keys and re-map vectors appended since the last refresh, including by other processes"""
+        if not os.path.exists(self.keys_file):
+            return
+        
+        with self.lock:
+            loaded = self.count
+            with open(self.keys_file, 'rb') as f:
+                f.seek(loaded * self.key_size)
+                data = f.read()
+            
+            count = loaded + len(data) // self.key_size
+            if count == loaded:
+                return
+            
+            for offset in range(0, (count - loaded) * self.key_size, self.key_size):
+                self.rows.setdefault(data[offset:offset + self.key_size], loaded + offset // self.key_size)
+            self.vectors = np.memmap(self.vectors_file, dtype=np.float32, mode='r', shape=(count, self.dimension))
+            self.count = count
+    
+    def put(self, keys: List[bytes], vectors: np.ndarray):
+        """Append vectors for keys that are not cached yet"""
+        with open(self.lock_file, 'w') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                self.refresh()
+                new = [i for i, key in enumerate(keys) if key not in self.rows]
+                if not new:
+                    return
+                
+                with open(self.vectors_file, 'ab') as f:
+                    # Drop vectors left without keys by an interrupted append
+                    f.truncate(self.count * self.dimension * 4)
+                    f.write(np.ascontiguousarray(vectors[new], dtype=np.float32).tobytes())
+                    f.flush()
+                    os.fsync(f.fileno())
+                with open(self.keys_file, 'ab') as f:
+                    f.write(b"".join(keys[i] for i in new))
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+        
+        self.refresh()
+    
+    def embed(self, texts: List[str], model_id: str, encode: Callable[[List[str]], np.ndarray]) -> np.ndarray:
+        """Return embeddings for texts, encoding only the ones missing from the cache"""
+        self.refresh()
+        keys = [self.key(model_id, text) for text in texts]
+        embeddings = np.empty((len(texts), self.dimension), dtype=np.float32)
+        
+        missing = []
+        with self.lock:
+            for i, key in enumerate(keys):
+                row = self.rows.get(key)
+                if row is None:
+                    missing.append(i)
+                else:
+                    embeddings[i] = self.vectors[row]
+        
+        if missing:
+            # Encode each distinct missing text once
+            unique = list(dict.fromkeys(texts[i] for i in missing))
+            encoded = np.asarray(encode(unique), dtype=np.float32)
+            by_text = dict(zip(unique, encoded))
+            for i in missing:
+                embeddings[i] = by_text[texts[i]]
+            self.put([self.key(model_id, text) for text in unique], encoded)
+        
+        return embeddings
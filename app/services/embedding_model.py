@@ -0,0 +1,42 @@
+import numpy as np
+from sentence_transformers import SentenceTransformer
+import os
+from typing import List
+
+def load_embedding_model(model_name: str, cpu_optimized: bool = False, num_threads: int = 0, max_seq_length: int = 0) -> SentenceTransformer:
+    """Load a SentenceTransformer, optionally int8-quantized for CPU inference"""
+    import torch
+    
+    if num_threads:
+        torch.set_num_threads(num_threads)
+    
+    model = SentenceTransformer(model_name, device="cpu" if cpu_optimized else None)
+    if max_seq_length:
+        model.max_seq_length = max_seq_length
+    
+    if cpu_optimized:
+        # Dynamic quantization: Linear weights stored as int8, activations quantized on the fly
+        model = torch.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+    
+    return model
+
+class EmbeddingModel:
+    """The sentence embedding model used by the vector store, configured from the environment"""
+    def __init__(self, model_name: str = 'all-MiniLM-L6-v2'):
+        self.model_name = model_name
+        self.cpu_optimized = os.getenv("EMBEDDING_CPU_OPTIMIZED", "false").lower() == "true"
+        self.num_threads = int(os.getenv("EMBEDDING_THREADS", "0"))
+        self.max_seq_length = int(os.getenv("EMBEDDING_MAX_SEQ_LENGTH", "128" if self.cpu_optimized else "0"))
+        self.batch_size = int(os.getenv("EMBEDDING_BATCH_SIZE", "32"))
+        self.model = load_embedding_model(model_name, self.cpu_optimized, self.num_threads, self.max_seq_length)
+    
+    @property
+    def model_id(self) -> str:
+        """Identifies the embeddings this configuration produces, for caching"""
+        if not self.cpu_optimized and not self.max_seq_length:
+            return self.model_name
+        return f"{self.model_name}:{'int8' if self.cpu_optimized else 'fp32'}:{self.max_seq_length or 'default'}"
+    
+    def encode(self, texts: List[str]) -> np.ndarray:
+        """Encode texts to float32 embeddings; encode sorts texts by length so batches carry little padding"""
+        return np.asarray(self.model.encode(texts, batch_size=self.batch_size), dtype=np.float32)
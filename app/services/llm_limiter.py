@@ -0,0 +1,195 @@
+import asyncio
+import contextvars
+import heapq
+import itertools
+import os
+import random
+import re
+import time
+from collections import deque
+from typing import Any, Dict, Optional
+
+try:
+    from google.api_core.exceptions import ResourceExhausted, TooManyRequests
+    RATE_LIMIT_ERRORS = (ResourceExhausted, TooManyRequests)
+except ImportError:
+    RATE_LIMIT_ERRORS = ()
+
+# Lower values are served first
+INTERACTIVE = 0
+BULK = 1
+PRIORITY_NAMES = {INTERACTIVE: "interactive", BULK: "bulk"}
+
+# Priority of LLM calls made from the current task; request handlers serving a user set INTERACTIVE
+llm_priority = contextvars.ContextVar("llm_priority", default=BULK)
+
+class LLMLimiter:
+    """Token bucket plus adaptive (AIMD) concurrency limit shared by every LLM call in the process.
+
+    The limits are per process: the deployment-wide LLM_REQUESTS_PER_MINUTE, LLM_BURST and
+    LLM_MAX_CONCURRENCY are divided by LLM_WORKERS (default WEB_CONCURRENCY, which uvicorn's
+    --workers also reads) so that all workers together stay within the quota.
+
+    Waiting calls are granted in priority order. Rate-limit errors halve the concurrency limit,
+    pause all calls for the server's retry-after (or an exponential backoff) and are retried.
+    """
+    def __init__(self):
+        self.workers = max(1, int(os.getenv("LLM_WORKERS", os.getenv("WEB_CONCURRENCY", "1"))))
+        self.rate = float(os.getenv("LLM_REQUESTS_PER_MINUTE", "15")) / 60 / self.workers
+        self.burst = max(1.0, float(os.getenv("LLM_BURST", "5")) / self.workers)
+        self.max_concurrency = max(1, int(os.getenv("LLM_MAX_CONCURRENCY", "8")) // self.workers)
+        self.max_retries = int(os.getenv("LLM_MAX_RETRIES", "4"))
+        self.backoff_base = float(os.getenv("LLM_BACKOFF_SECONDS", "2"))
+        self.backoff_max = 60.0
+
+        self.tokens = self.burst
+        self.updated = time.monotonic()
+        self.concurrency_limit = float(self.max_concurrency)
+        self.in_flight = 0
+        self.paused_until = 0.0
+        self.waiters = []  # heap of (priority, sequence, future)
+        self.sequence = itertools.count()
+        self.timer = None
+
+        self.stats = {
+            priority: {"calls": 0, "total_delay": 0.0, "max_delay": 0.0, "recent": deque(maxlen=1000)}
+            for priority in PRIORITY_NAMES
+        }
+        self.throttled = 0
+        self.retries = 0
+
+    def refill(self, now: float):
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def dispatch(self):
+        """Grant slots to waiters while tokens, concurrency and any pause allow"""
+        now = time.monotonic()
+        self.refill(now)
+
+        while self.waiters:
+            if self.waiters[0][2].done():  # Cancelled while waiting
+                heapq.heappop(self.waiters)
+                continue
+            if self.in_flight >= int(self.concurrency_limit):
+                return  # Woken again by release
+
+            wait = max(self.paused_until - now, (1 - self.tokens) / self.rate if self.tokens < 1 else 0)
+            if wait > 0:
+                if self.timer is None:
+                    self.timer = asyncio.get_running_loop().call_later(wait, self.on_timer)
+                return
+
+            _, _, future = heapq.heappop(self.waiters)
+            self.tokens -= 1
+            self.in_flight += 1
+            future.set_result(None)
+
+    def on_timer(self):
+        self.timer = None
+        self.dispatch()
+
+    async def acquire(self, priority: int):
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self.waiters, (priority, next(self.sequence), future))
+        self.dispatch()
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                self.release()
+            raise
+
+    def release(self):
+        self.in_flight -= 1
+        self.dispatch()
+
+    def record_delay(self, priority: int, delay: float):
+        stats = self.stats[priority]
+        stats["calls"] += 1
+        stats["total_delay"] += delay
+        stats["max_delay"] = max(stats["max_delay"], delay)
+        stats["recent"].append(delay)
+
+    def is_rate_limit_error(self, error: Exception) -> bool:
+        if RATE_LIMIT_ERRORS and isinstance(error, RATE_LIMIT_ERRORS):
+            return True
+        message = str(error).lower()
+        return "429" in message or "resource exhausted" in message or "quota" in message or "rate limit" in message
+
+    def retry_after(self, error: Exception) -> Optional[float]:
+        """Server-suggested delay from a Retry-After header or a retry delay in the error message"""
+        response = getattr(error, "response", None)
+        header = getattr(response, "headers", {}).get("retry-after") if response is not None else None
+        if header:
+            try:
+                return float(header)
+            except ValueError:
+                pass
+
+        match = re.search(r"retry[_ -]?(?:after|delay|in)\D{0,20}?(\d+(?:\.\d+)?)", str(error), re.IGNORECASE)
+        return float(match.group(1)) if match else None
+
+    def on_throttled(self, delay: float):
+        """Multiplicative decrease and a pause of every caller until the quota recovers"""
+        self.throttled += 1
+        self.concurrency_limit = max(1.0, self.concurrency_limit / 2)
+        self.paused_until = max(self.paused_until, time.monotonic() + delay)
+        self.tokens = min(self.tokens, 0)
+
+    def on_success(self):
+        """Additive increase of the concurrency limit"""
+        self.concurrency_limit = min(float(self.max_concurrency), self.concurrency_limit + 1 / self.concurrency_limit)
+
+    async def ainvoke(self, llm, prompt: Any, priority: int = None):
+        """Call llm.ainvoke(prompt) under the shared rate and concurrency limits"""
+        priority = llm_priority.get() if priority is None else priority
+
+        for attempt in range(self.max_retries + 1):
+            queued_at = time.monotonic()
+            await self.acquire(priority)
+            self.record_delay(priority, time.monotonic() - queued_at)
+
+            try:
+                response = await llm.ainvoke(prompt)
+            except Exception as e:
+                if not self.is_rate_limit_error(e) or attempt == self.max_retries:
+                    raise
+                delay = self.retry_after(e)
+                if delay is None:
+                    delay = min(self.backoff_max, self.backoff_base * 2 ** attempt) * random.uniform(0.5, 1.5)
+                print(f"LLM rate limited, retrying in {delay:.1f}s (attempt {attempt + 1}/{self.max_retries})")
+                self.retries += 1
+                self.on_throttled(delay)
+            else:
+                self.on_success()
+                return response
+            finally:
+                self.release()
+
+    def metrics(self) -> Dict:
+        """Queueing delay per priority and the limiter's current state"""
+        queueing = {}
+        for priority, name in PRIORITY_NAMES.items():
+            stats = self.stats[priority]
+            recent = sorted(stats["recent"])
+            queueing[name] = {
+                "calls": stats["calls"],
+                "mean_delay_seconds": stats["total_delay"] / stats["calls"] if stats["calls"] else 0.0,
+                "p95_delay_seconds": recent[min(len(recent) - 1, int(len(recent) * 0.95))] if recent else 0.0,
+                "max_delay_seconds": stats["max_delay"]
+            }
+
+        return {
+            "queueing": queueing,
+            "workers": self.workers,
+            "requests_per_minute": self.rate * 60,
+            "in_flight": self.in_flight,
+            "waiting": sum(1 for _, _, future in self.waiters if not future.done()),
+            "concurrency_limit": int(self.concurrency_limit),
+            "throttled": self.throttled,
+            "retries": self.retries
+        }
+
+# Global instance
+llm_limiter = LLMLimiter()
@@ -0,0 +1,24 @@
+import threading
+from collections import OrderedDict
+from typing import Any, Hashable
+
+class LRUCache:
+    """Thread-safe mapping that evicts the least recently used entry beyond max_size"""
+    def __init__(self, max_size: int = 1024):
+        self.max_size = max_size
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+    
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        with self.lock:
+            if key not in self.entries:
+                return default
+            self.entries.move_to_end(key)
+            return self.entries[key]
+    
+    def put(self, key: Hashable, value: Any):
+        with self.lock:
+            self.entries[key] = value
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
@@ -0,0 +1,40 @@
+from sqlalchemy import insert
+import os
+from typing import List, Dict
+from datetime import datetime
+
+from ..database import AsyncSessionLocal
+from ..models import Newsletter
+
+class NewsletterService:
+    def __init__(self):
+        self.batch_size = int(os.getenv("NEWSLETTER_INSERT_BATCH_SIZE", "100"))
+    
+    def build_record(self, user_id: int, result: Dict, status: str = None) -> Dict:
+        """Build a newsletters row from a newsletter generation result"""
+        return {
+            'user_id': user_id,
+            'title': result.get('title', ''),
+            'content': result.get('content', ''),
+            'html_content': result.get('newsletter_content', ''),
+            'sent_at': datetime.utcnow(),
+            'status': status or result.get('status', 'failed')
+        }
+    
+    async def save_newsletter(self, user_id: int, result: Dict) -> int:
+        """Persist a single generated newsletter and return its id"""
+        async with AsyncSessionLocal() as db:
+            newsletter = Newsletter(**self.build_record(user_id, result))
+            db.add(newsletter)
+            await db.commit()
+            return newsletter.id
+    
+    async def save_newsletters(self, records: List[Dict]):
+        """Bulk insert newsletters rows built with build_record"""
+        if not records:
+            return
+        async with AsyncSessionLocal() as db:
+            await db.execute(insert(Newsletter), records)
+            await db.commit()
+
+newsletter_service = NewsletterService()
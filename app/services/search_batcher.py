@@ -0,0 +1,84 @@
+import asyncio
+import os
+from typing import List, Dict
+
+from .lru_cache import LRUCache
+from .vector_service import vector_service
+
+class SearchBatcher:
+    """Coalesces concurrent article searches into batched VectorService.search_batch calls"""
+    def __init__(self):
+        self.max_batch_size = int(os.getenv("SEARCH_MAX_BATCH_SIZE", "32"))
+        self.max_wait = float(os.getenv("SEARCH_MAX_WAIT_MS", "5")) / 1000
+        # Results are keyed by index version, so a newly published index invalidates them
+        self.results = LRUCache(int(os.getenv("SEARCH_RESULT_CACHE_SIZE", "1024")))
+        self.queue = None
+        self.worker = None
+    
+    async def search(self, query: str, k: int = 10, interests: List[str] = None) -> List[Dict]:
+        """Search for similar articles, sharing model and index calls with concurrent requests"""
+        await asyncio.to_thread(vector_service.refresh_index)
+        key = (query, k, tuple(sorted(interests or [])), vector_service.index_version)
+        cached = self.results.get(key)
+        if cached is not None:
+            return [dict(article) for article in cached]
+        
+        if self.worker is None or self.worker.done():
+            self.queue = asyncio.Queue()
+            self.worker = asyncio.create_task(self.run())
+        
+        future = asyncio.get_running_loop().create_future()
+        await self.queue.put((query, k, interests, future))
+        results = await future
+        
+        self.results.put(key, results)
+        return [dict(article) for article in results]
+    
+    async def next_batch(self) -> List:
+        """Wait for a request, then gather more for up to max_wait or until the batch is full"""
+        batch = [await self.queue.get()]
+        deadline = asyncio.get_running_loop().time() + self.max_wait
+        
+        while len(batch) < self.max_batch_size:
+            if not self.queue.empty():
+                batch.append(self.queue.get_nowait())
+                continue
+            timeout = deadline - asyncio.get_running_loop().time()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self.queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+        
+        return batch
+    
+    async def run(self):
+        """Serve batches until cancelled"""
+        while True:
+            batch = await self.next_batch()
+            try:
+                # Encoding and FAISS search run off the event loop
+                results = await asyncio.to_thread(
+                    vector_service.search_batch,
+                    [query for query, _, _, _ in batch],
+                    [k for _, k, _, _ in batch],
+                    [interests for _, _, interests, _ in batch]
+                )
+            except Exception as e:
+                for _, _, _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+            
+            for (_, _, _, future), result in zip(batch, results):
+                if not future.done():
+                    future.set_result(result)
+    
+    async def close(self):
+        """Stop the batching worker"""
+        if self.worker is not None:
+            self.worker.cancel()
+            self.worker = None
+
+search_batcher = SearchBatcher()
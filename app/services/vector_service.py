@@ -1,101 +1,430 @@
 import faiss
 import numpy as np
-from sentence_transformers import SentenceTransformer
+from sqlalchemy import select, delete, update, func
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import load_only
+import fcntl
 import pickle
 import os
-from typing import List, Dict, Tuple
+import time
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from typing import List, Dict
+
+from ..database import SessionLocal
+from ..models import Article
+from .embedding_cache import EmbeddingCache
+from .embedding_model import EmbeddingModel
+from .lru_cache import LRUCache
 
 class VectorService:
     def __init__(self):
-        self.model = SentenceTransformer('all-MiniLM-L6-v2')
+        self.model = EmbeddingModel('all-MiniLM-L6-v2')
         self.dimension = 384  # Dimension of the embedding model
-        self.index = faiss.IndexFlatIP(self.dimension)  # Inner product for cosine similarity
-        self.articles_metadata = []  # Store article metadata
-        self.index_file = "faiss_index.bin"
-        self.metadata_file = "articles_metadata.pkl"
+        # Every embedding is looked up here before the model is run
+        self.embedding_cache = EmbeddingCache(self.dimension, os.getenv("EMBEDDING_CACHE_PATH", "embedding_cache"))
+        self.index = self.new_index()
+        # Unversioned files from before metadata moved to the articles table
+        self.legacy_index_file = "faiss_index.bin"
+        self.legacy_metadata_file = "articles_metadata.pkl"
+        # Published versions are written once and never modified; this pointer file names the current one
+        self.current_file = "faiss_index.current"
+        self.lock_file = "faiss_index.lock"
+        self.keep_versions = 2
+        # Memory-map a read-only index so every worker shares the same page cache copy
+        self.use_mmap = os.getenv("VECTOR_INDEX_MMAP", "false").lower() == "true"
+        self.query_embeddings = LRUCache(int(os.getenv("QUERY_EMBEDDING_CACHE_SIZE", "4096")))
+        # Retention applied by compact_index; 0 disables the limit
+        self.retention_days = int(os.getenv("VECTOR_RETENTION_DAYS", "0"))
+        self.max_per_category = int(os.getenv("VECTOR_MAX_PER_CATEGORY", "0"))
+        # Weight of redundancy against relevance when ranking articles for a newsletter
+        self.ranking_diversity = float(os.getenv("RANKING_DIVERSITY", "0.3"))
+        self.index_version = None
+        self.pointer_mtime = None
         self.load_index()
     
+    def article_text(self, article: Dict) -> str:
+        """Text that is embedded for an article"""
+        return f"{article['title']} {article['content']}"
+    
+    def encode_texts(self, texts: List[str]) -> np.ndarray:
+        """Run the model and L2-normalize the embeddings for cosine similarity"""
+        embeddings = np.asarray(self.model.encode(texts), dtype=np.float32)
+        faiss.normalize_L2(embeddings)
+        return embeddings
+    
+    def encode(self, texts: List[str]) -> np.ndarray:
+        """Return normalized embeddings, encoding only texts missing from the embedding cache"""
+        return self.embedding_cache.embed(texts, self.model.model_id, self.encode_texts)
+    
+    def new_index(self):
+        """Create an empty index whose vector ids are article ids"""
+        return faiss.IndexIDMap2(faiss.IndexFlatIP(self.dimension))  # Inner product for cosine similarity
+    
+    def version_file(self, version: str) -> str:
+        """Return the index file name for a published version"""
+        return f"faiss_index.{version}.bin"
+    
+    def read_current_version(self) -> str:
+        """Read the currently published index version, if any"""
+        try:
+            with open(self.current_file) as f:
+                return f.read().strip() or None
+        except FileNotFoundError:
+            return None
+    
+    def read_index_file(self, index_file: str, writable: bool = False):
+        """Read an index, memory-mapped unless a writable copy is needed"""
+        if self.use_mmap and not writable:
+            flags = faiss.IO_FLAG_MMAP | getattr(faiss, "IO_FLAG_MMAP_IFC", 0) | faiss.IO_FLAG_READ_ONLY
+            return faiss.read_index(index_file, flags)
+        return faiss.read_index(index_file)
+    
     def load_index(self):
-        """Load existing FAISS index and metadata if they exist"""
-        if os.path.exists(self.index_file) and os.path.exists(self.metadata_file):
-            self.index = faiss.read_index(self.index_file)
-            with open(self.metadata_file, 'rb') as f:
-                self.articles_metadata = pickle.load(f)
-    
-    def save_index(self):
-        """Save FAISS index and metadata to disk"""
-        faiss.write_index(self.index, self.index_file)
-        with open(self.metadata_file, 'wb') as f:
-            pickle.dump(self.articles_metadata, f)
+        """Load the currently published FAISS index if one exists"""
+        version = self.read_current_version()
+        if version:
+            self.index = self.read_index_file(self.version_file(version))
+            self.index_version = version
+            self.pointer_mtime = os.stat(self.current_file).st_mtime_ns
+    
+    def refresh_index(self):
+        """Pick up a newer published index version written by another process"""
+        try:
+            mtime = os.stat(self.current_file).st_mtime_ns
+        except FileNotFoundError:
+            return
+        if mtime == self.pointer_mtime:
+            return
+        version = self.read_current_version()
+        if version and version != self.index_version:
+            self.load_index()
+        else:
+            self.pointer_mtime = mtime
+    
+    @contextmanager
+    def writer_lock(self):
+        """Serialize index writers across processes with an exclusive file lock"""
+        with open(self.lock_file, 'w') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+    
+    def load_writable_index(self):
+        """Load a private writable copy of the latest published index (call under writer_lock)"""
+        version = self.read_current_version()
+        if version:
+            return self.read_index_file(self.version_file(version), writable=True)
+        return self.new_index()
+    
+    def publish_index(self, index) -> str:
+        """Write a new immutable index version and atomically switch readers to it (call under writer_lock)"""
+        version = f"{time.time_ns()}-{os.getpid()}"
+        index_file = self.version_file(version)
+        
+        faiss.write_index(index, index_file + ".tmp")
+        os.replace(index_file + ".tmp", index_file)
+        
+        with open(self.current_file + ".tmp", 'w') as f:
+            f.write(version)
+        os.replace(self.current_file + ".tmp", self.current_file)
+        
+        self.remove_old_versions(keep=version)
+        return version
+    
+    def remove_old_versions(self, keep: str):
+        """Delete superseded versions; readers that still map them keep their pages until they reload"""
+        versions = sorted(
+            name[len("faiss_index."):-len(".bin")]
+            for name in os.listdir(".")
+            if name.startswith("faiss_index.") and name.endswith(".bin") and name != self.legacy_index_file
+        )
+        previous = [v for v in versions if v != keep]
+        # Keep the newest superseded versions too, so a reader mid-reload still finds its files
+        for version in previous[:max(len(previous) - (self.keep_versions - 1), 0)]:
+            try:
+                os.remove(self.version_file(version))
+            except FileNotFoundError:
+                pass
+    
+    def migrate_legacy_metadata(self):
+        """Move the pickled metadata of an unversioned index into the articles table"""
+        if not (os.path.exists(self.legacy_index_file) and os.path.exists(self.legacy_metadata_file)):
+            return
+        
+        with self.writer_lock():
+            if self.read_current_version():
+                return  # Already migrated by another worker
+            
+            legacy_index = faiss.read_index(self.legacy_index_file)
+            with open(self.legacy_metadata_file, 'rb') as f:
+                legacy_metadata = pickle.load(f)
+            
+            count = min(legacy_index.ntotal, len(legacy_metadata))
+            embeddings = legacy_index.reconstruct_n(0, count) if count else None
+            
+            with SessionLocal() as db:
+                rows = [
+                    Article(
+                        title=metadata['title'],
+                        url=metadata['url'],
+                        source=metadata['source'],
+                        category=metadata['category'],
+                        published_at=metadata.get('published_at')
+                    )
+                    for metadata in legacy_metadata[:count]
+                ]
+                db.add_all(rows)
+                db.flush()
+                
+                index = self.new_index()
+                if rows:
+                    for row in rows:
+                        row.embedding_id = str(row.id)
+                    index.add_with_ids(embeddings, np.array([row.id for row in rows], dtype=np.int64))
+                
+                self.publish_index(index)
+                db.commit()
+        
+        self.load_index()
+        print(f"Migrated {count} articles from {self.legacy_metadata_file} to the articles table")
     
     def add_articles(self, articles: List[Dict]):
         """Add articles to the vector store"""
+        with SessionLocal() as db:
+            # Skip articles that are already stored
+            urls = [article['url'] for article in articles if article.get('url')]
+            known_urls = set(db.scalars(select(Article.url).where(Article.url.in_(urls)))) if urls else set()
+            
+            # Mark stored articles that were seen again as recently collected
+            if known_urls:
+                db.execute(update(Article).where(Article.url.in_(known_urls)).values(scraped_at=datetime.utcnow()))
+                db.commit()
+        
+        new_articles = []
         for article in articles:
-            # Create embedding
-            text = f"{article['title']} {article['content']}"
-            embedding = self.model.encode([text])
+            if article.get('url') in known_urls:
+                continue
+            known_urls.add(article.get('url'))
+            new_articles.append(article)
+        
+        if not new_articles:
+            return
+        
+        # Create embeddings before taking the writer lock, which is then held only for the writes
+        embeddings = self.encode([self.article_text(article) for article in new_articles])
+        
+        with self.writer_lock(), SessionLocal() as db:
+            # Check again under the lock: another writer may have stored some of these in the meantime
+            urls = [article['url'] for article in new_articles if article.get('url')]
+            stored_urls = set(db.scalars(select(Article.url).where(Article.url.in_(urls)))) if urls else set()
+            keep = [i for i, article in enumerate(new_articles) if article.get('url') not in stored_urls]
+            if not keep:
+                return
             
-            # Normalize for cosine similarity
-            faiss.normalize_L2(embedding)
+            # Store metadata
+            rows = [
+                Article(
+                    title=new_articles[i]['title'],
+                    content=new_articles[i]['content'],
+                    url=new_articles[i]['url'],
+                    source=new_articles[i]['source'],
+                    category=new_articles[i]['category'],
+                    published_at=new_articles[i].get('published_at')
+                )
+                for i in keep
+            ]
+            db.add_all(rows)
+            db.flush()
+            for row in rows:
+                row.embedding_id = str(row.id)
             
-            # Add to index
-            self.index.add(embedding)
+            # Start from the latest published version so concurrent writers never clobber each other
+            index = self.load_writable_index()
+            index.add_with_ids(embeddings[keep], np.array([row.id for row in rows], dtype=np.int64))
+            self.publish_index(index)
             
-            # Store metadata
-            self.articles_metadata.append({
-                'id': article.get('id'),
-                'title': article['title'],
-                'url': article['url'],
-                'source': article['source'],
-                'category': article['category'],
-                'published_at': article.get('published_at')
-            })
+            # Commit while still holding the lock, so compact_index never sees these vectors without rows
+            db.commit()
+        
+        # Drop the writable copy and re-open the published version (memory-mapped in mmap mode)
+        self.load_index()
+    
+    def encode_queries(self, queries: List[str]) -> np.ndarray:
+        """Return normalized query embeddings, encoding only queries missing from the in-memory LRU.
         
-        self.save_index()
+        Queries bypass the on-disk embedding cache so it does not grow with every distinct search.
+        """
+        embeddings = {query: self.query_embeddings.get(query) for query in dict.fromkeys(queries)}
+        missing = [query for query, embedding in embeddings.items() if embedding is None]
+        if missing:
+            for query, embedding in zip(missing, self.encode_texts(missing)):
+                embeddings[query] = embedding
+                self.query_embeddings.put(query, embedding)
+        return np.stack([embeddings[query] for query in queries])
     
     def search_similar_articles(self, query: str, k: int = 10, interests: List[str] = None) -> List[Dict]:
         """Search for similar articles based on query and user interests"""
-        # Create query embedding
-        query_embedding = self.model.encode([query])
-        faiss.normalize_L2(query_embedding)
+        return self.search_batch([query], [k], [interests])[0]
+    
+    def search_batch(self, queries: List[str], ks: List[int], interests_list: List[List[str]]) -> List[List[Dict]]:
+        """Search several queries with one encode call, one FAISS search and one metadata query"""
+        self.refresh_index()
+        index = self.index
+        if index.ntotal == 0:
+            return [[] for _ in queries]
+        
+        # Create query embeddings
+        query_embeddings = self.encode_queries(queries)
         
         # Search in FAISS
-        scores, indices = self.index.search(query_embedding, min(k * 2, self.index.ntotal))
+        scores, ids = index.search(query_embeddings, min(max(ks) * 2, index.ntotal))
+        hits = [
+            [(int(article_id), float(score)) for score, article_id in zip(scores[row][:k * 2], ids[row][:k * 2]) if article_id >= 0]
+            for row, k in enumerate(ks)
+        ]
         
-        # Filter and rank results
-        results = []
-        for score, idx in zip(scores[0], indices[0]):
-            if idx >= len(self.articles_metadata):
-                continue
+        # Fetch metadata for all hits in one keyed query
+        hit_ids = {article_id for query_hits in hits for article_id, _ in query_hits}
+        stmt = select(Article).options(load_only(
+            Article.id, Article.title, Article.url, Article.source, Article.category, Article.published_at
+        )).where(Article.id.in_(hit_ids))
+        
+        with SessionLocal() as db:
+            articles = {article.id: article for article in db.scalars(stmt)}
+        
+        # Rank results in FAISS order, filtering by interests if provided
+        batch_results = []
+        for query_hits, k, interests in zip(hits, ks, interests_list):
+            results = []
+            for article_id, score in query_hits:
+                article = articles.get(article_id)
+                if article is None or (interests and article.category not in interests):
+                    continue
                 
-            article = self.articles_metadata[idx]
-            
-            # Filter by interests if provided
-            if interests and article['category'] not in interests:
-                continue
+                results.append({
+                    'id': article.id,
+                    'title': article.title,
+                    'url': article.url,
+                    'source': article.source,
+                    'category': article.category,
+                    'published_at': article.published_at,
+                    'similarity_score': score
+                })
+                
+                if len(results) >= k:
+                    break
+            batch_results.append(results)
+        
+        return batch_results
+    
+    def find_stale_articles(self, db, retention_days: int, max_per_category: int) -> set:
+        """Ids of articles older than the retention period or beyond the newest max_per_category of their category"""
+        age = func.coalesce(Article.published_at, Article.scraped_at)
+        stale = set()
+        
+        if retention_days:
+            cutoff = datetime.utcnow() - timedelta(days=retention_days)
+            stale.update(db.scalars(select(Article.id).where(age < cutoff)))
+        
+        if max_per_category:
+            ranked = select(
+                Article.id,
+                func.row_number().over(partition_by=Article.category, order_by=(age.desc(), Article.id.desc())).label("rank")
+            ).subquery()
+            stale.update(db.scalars(select(ranked.c.id).where(ranked.c.rank > max_per_category)))
+        
+        return stale
+    
+    def compact_index(self, retention_days: int = None, max_per_category: int = None) -> Dict:
+        """Drop stale articles and rebuild a dense index without them.
+        
+        Searches keep using the previously published version until the compacted one is published.
+        """
+        retention_days = self.retention_days if retention_days is None else retention_days
+        max_per_category = self.max_per_category if max_per_category is None else max_per_category
+        
+        with SessionLocal() as db:
+            stale = self.find_stale_articles(db, retention_days, max_per_category)
             
-            article['similarity_score'] = float(score)
-            results.append(article)
+            with self.writer_lock():
+                version = self.read_current_version()
+                old_size = os.path.getsize(self.version_file(version)) if version else 0
+                index = self.load_writable_index()
+                
+                ids = faiss.vector_to_array(index.id_map).astype(np.int64)
+                known = set(db.scalars(select(Article.id)))
+                # Also drops vectors whose article row no longer exists
+                keep = np.array([int(i) in known and int(i) not in stale for i in ids], dtype=bool)
+                
+                compacted = self.new_index()
+                if keep.any():
+                    vectors = index.index.reconstruct_n(0, index.ntotal)[keep]
+                    compacted.add_with_ids(vectors, ids[keep])
+                
+                new_version = self.publish_index(compacted)
+                new_size = os.path.getsize(self.version_file(new_version))
             
-            if len(results) >= k:
-                break
+            stale_ids = list(stale)
+            for start in range(0, len(stale_ids), 500):
+                db.execute(delete(Article).where(Article.id.in_(stale_ids[start:start + 500])))
+            db.commit()
+        
+        self.load_index()
+        
+        report = {
+            "removed_articles": len(stale),
+            "removed_vectors": int(len(ids) - keep.sum()),
+            "remaining_vectors": int(keep.sum()),
+            "reclaimed_bytes": old_size - new_size
+        }
+        print(f"Vector store compacted: {report}")
+        return report
+    
+    def rank_articles(self, articles: List[Dict], interests: List[str], k: int = 10, diversity: float = None) -> List[Dict]:
+        """Select the k articles most relevant to the interests and least redundant with each other (MMR)"""
+        if not articles:
+            return []
+        if diversity is None:
+            diversity = self.ranking_diversity
+        
+        article_embeddings = self.encode([self.article_text(article) for article in articles])
+        interest_embeddings = self.encode(interests)
         
-        return results
+        # Relevance is the best cosine similarity to any of the interests
+        relevance = (article_embeddings @ interest_embeddings.T).max(axis=1)
+        similarity = article_embeddings @ article_embeddings.T
+        
+        # Maximal marginal relevance: trade relevance against similarity to already selected articles
+        selected = []
+        redundancy = np.zeros(len(articles), dtype=np.float32)
+        available = np.ones(len(articles), dtype=bool)
+        for step in range(min(k, len(articles))):
+            scores = np.where(available, (1 - diversity) * relevance - diversity * redundancy, -np.inf)
+            best = int(np.argmax(scores))
+            selected.append(best)
+            available[best] = False
+            redundancy = similarity[best].copy() if step == 0 else np.maximum(redundancy, similarity[best])
+        
+        ranked = []
+        for i in selected:
+            article = articles[i]
+            article['relevance_score'] = float(relevance[i])
+            ranked.append(article)
+        return ranked
     
-    def get_trending_topics(self, interests: List[str] = None) -> List[str]:
+    async def get_trending_topics(self, db: AsyncSession, interests: List[str] = None) -> List[str]:
         """Get trending topics from stored articles"""
         # Simple implementation - in production, use more sophisticated topic modeling
-        categories = {}
-        for article in self.articles_metadata:
-            if interests and article['category'] not in interests:
-                continue
-            
-            category = article['category']
-            categories[category] = categories.get(category, 0) + 1
+        stmt = select(Article.category, func.count(Article.id).label("count")).group_by(Article.category)
+        if interests:
+            stmt = stmt.where(Article.category.in_(interests))
         
         # Sort by frequency and return top topics
-        trending = sorted(categories.items(), key=lambda x: x[1], reverse=True)
-        return [topic for topic, count in trending[:5]]
+        stmt = stmt.order_by(func.count(Article.id).desc()).limit(5)
+        return [topic for topic, count in await db.execute(stmt)]
     
 # Global instance
 vector_service = VectorService()
@@ -0,0 +1,128 @@
+#!/usr/bin/env python3
+"""
+Benchmark the CPU-optimized embedding path against full-precision embeddings
+
+Measures encoding throughput of both configurations and checks retrieval quality
+of the optimized embeddings on a fixture corpus.
+
+Usage: python benchmark_embeddings.py [--corpus articles.json] [--threads 4] [--repeat 8]
+"""
+import argparse
+import json
+import time
+import numpy as np
+
+from app.services.embedding_model import load_embedding_model
+
+MODEL_NAME = "all-MiniLM-L6-v2"
+
+# Fixture corpus: short tech news items across the categories users subscribe to
+FIXTURE_ARTICLES = [
+    "OpenAI releases a new multimodal model that can reason over images, audio and text in real time.",
+    "Google DeepMind shows a protein-folding model that predicts interactions between molecules and DNA.",
+    "A startup raises $40M to build open-source tooling for fine-tuning large language models on private data.",
+    "Researchers find that small language models trained on synthetic textbooks rival much larger models on coding tasks.",
+    "The EU AI Act enters into force, setting transparency obligations for general-purpose AI providers.",
+    "Nvidia unveils its next-generation data center GPU with more memory bandwidth for training transformers.",
+    "Tesla cuts Model 3 prices again as competition from Chinese EV makers intensifies in Europe.",
+    "A new solid-state battery prototype charges an electric car to 80 percent in twelve minutes.",
+    "Ford delays its three-row electric SUV and shifts investment toward hybrid vehicles.",
+    "Charging networks agree on a common plug standard, making fast chargers usable by most electric vehicles.",
+    "Rivian opens its charging network to other EV brands across the United States.",
+    "BYD overtakes Tesla as the world's largest seller of battery electric vehicles for the quarter.",
+    "Matter 1.3 adds energy reporting for smart plugs, appliances and EV chargers in the smart home.",
+    "A botnet of compromised IoT cameras launches one of the largest DDoS attacks recorded this year.",
+    "Industrial IoT sensors with on-device machine learning detect motor failures weeks in advance.",
+    "A low-power wide-area network operator expands LoRaWAN coverage for agricultural sensors.",
+    "Smart thermostats cut household heating bills by learning occupancy patterns, a utility study finds.",
+    "Edge gateways running containerized workloads are becoming the default for factory IoT deployments.",
+    "Apple announces on-device AI features that summarize notifications and rewrite emails.",
+    "Microsoft adds a coding agent to its IDE that can open pull requests on its own.",
+    "Quantum computing startup demonstrates error-corrected logical qubits on a neutral-atom machine.",
+    "A critical vulnerability in a popular VPN appliance is being exploited in the wild, CISA warns.",
+    "SpaceX launches another batch of Starlink satellites with direct-to-cell capability.",
+    "Semiconductor makers announce new fabs in Arizona and Ohio backed by CHIPS Act funding.",
+]
+
+FIXTURE_QUERIES = [
+    "large language model research",
+    "electric vehicle battery charging",
+    "IoT security and botnets",
+    "smart home energy devices",
+    "AI regulation in Europe",
+    "GPU hardware for AI training",
+    "EV market competition and sales",
+    "developer tools powered by AI",
+]
+
+def load_corpus(path: str):
+    """Load articles as a list of strings or of dicts with title/content"""
+    with open(path) as f:
+        items = json.load(f)
+    return [item if isinstance(item, str) else f"{item.get('title', '')} {item.get('content', '')}" for item in items]
+
+def normalize(embeddings: np.ndarray) -> np.ndarray:
+    return embeddings / np.linalg.norm(embeddings, axis=1, keepdims=True)
+
+def measure_throughput(encode, texts, runs: int = 3) -> float:
+    """Best-of-N texts per second"""
+    encode(texts[:8])  # Warm up
+    best = float("inf")
+    for _ in range(runs):
+        start = time.perf_counter()
+        encode(texts)
+        best = min(best, time.perf_counter() - start)
+    return len(texts) / best
+
+def top_k(queries: np.ndarray, corpus: np.ndarray, k: int) -> np.ndarray:
+    return np.argsort(-(queries @ corpus.T), axis=1)[:, :k]
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--corpus", help="JSON file of articles (strings or {title, content} objects)")
+    parser.add_argument("--threads", type=int, default=0, help="torch intra-op threads for the optimized model")
+    parser.add_argument("--max-seq-length", type=int, default=128)
+    parser.add_argument("--batch-size", type=int, default=32)
+    parser.add_argument("--repeat", type=int, default=8, help="repeat the corpus to get a stable throughput number")
+    parser.add_argument("--k", type=int, default=5)
+    args = parser.parse_args()
+
+    corpus = load_corpus(args.corpus) if args.corpus else FIXTURE_ARTICLES
+    bench_texts = corpus * args.repeat
+
+    print(f"Loading {MODEL_NAME} (full precision and int8)...")
+    baseline = load_embedding_model(MODEL_NAME)
+    optimized = load_embedding_model(MODEL_NAME, cpu_optimized=True, num_threads=args.threads, max_seq_length=args.max_seq_length)
+
+    def encode_baseline(texts):
+        return baseline.encode(texts, batch_size=args.batch_size, convert_to_numpy=True)
+
+    def encode_optimized(texts):
+        return optimized.encode(texts, batch_size=args.batch_size, convert_to_numpy=True)
+
+    print(f"\nThroughput on {len(bench_texts)} texts:")
+    baseline_tps = measure_throughput(encode_baseline, bench_texts)
+    optimized_tps = measure_throughput(encode_optimized, bench_texts)
+    print(f"  full precision: {baseline_tps:8.1f} texts/s")
+    print(f"  cpu optimized:  {optimized_tps:8.1f} texts/s ({optimized_tps / baseline_tps:.2f}x)")
+
+    # Retrieval quality: optimized embeddings against full-precision ones on the same corpus
+    corpus_fp = normalize(encode_baseline(corpus))
+    corpus_q = normalize(encode_optimized(corpus))
+    queries_fp = normalize(encode_baseline(FIXTURE_QUERIES))
+    queries_q = normalize(encode_optimized(FIXTURE_QUERIES))
+
+    k = min(args.k, len(corpus))
+    reference = top_k(queries_fp, corpus_fp, k)
+    # Quantized corpus searched with quantized queries, and with full-precision queries (mixed index)
+    recall_q = np.mean([len(set(a) & set(b)) / k for a, b in zip(reference, top_k(queries_q, corpus_q, k))])
+    recall_mixed = np.mean([len(set(a) & set(b)) / k for a, b in zip(reference, top_k(queries_q, corpus_fp, k))])
+    cosine = np.sum(corpus_fp * corpus_q, axis=1)
+
+    print(f"\nRetrieval quality ({len(corpus)} articles, {len(FIXTURE_QUERIES)} queries):")
+    print(f"  embedding cosine vs full precision: mean {cosine.mean():.4f}, min {cosine.min():.4f}")
+    print(f"  recall@{k} (int8 queries, int8 corpus): {recall_q:.3f}")
+    print(f"  recall@{k} (int8 queries, fp32 corpus): {recall_mixed:.3f}")
+
+if __name__ == "__main__":
+    main()